@@ -5,75 +5,182 @@ Outputs markdown suitable for PR comments.
 """
 
 import json
+import os
 import subprocess
 import sys
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    # Fall back to the stdlib json module
+    orjson = None
+
+# Debug logging to stderr, off unless DIFF_REPORT_DEBUG is set
+DEBUG = bool(os.environ.get('DIFF_REPORT_DEBUG'))
+
+
+def json_loads(data):
+    """Parse JSON from bytes, using orjson when available."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 def run_git_command(cmd):
     """Run a git command and return output, with error handling."""
     try:
         result = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        print(f"DEBUG: Running: {' '.join(cmd)}", file=sys.stderr)
-        print(f"DEBUG: Return code: {result.returncode}", file=sys.stderr)
-        print(f"DEBUG: Output: {result.stdout[:200]}", file=sys.stderr)
+        if DEBUG:
+            print(f"DEBUG: Running: {' '.join(cmd)}", file=sys.stderr)
+            print(f"DEBUG: Return code: {result.returncode}", file=sys.stderr)
+            print(f"DEBUG: Output: {result.stdout[:200]}", file=sys.stderr)
         return result
     except Exception as e:
-        print(f"DEBUG: Git command failed: {e}", file=sys.stderr)
+        if DEBUG:
+            print(f"DEBUG: Git command failed: {e}", file=sys.stderr)
         return None
 
 
 def get_changed_files():
     """Get list of changed data model files in the PR."""
-    print("DEBUG: Looking for changed files...", file=sys.stderr)
+    if DEBUG:
+        print("DEBUG: Looking for changed files...", file=sys.stderr)
     
-    # Try different git diff strategies
-    strategies = [
-        # PR context - compare PR head to base
-        ['git', 'diff', '--name-only', 'origin/main...HEAD'],
-        ['git', 'diff', '--name-only', 'origin/main', 'HEAD'],
-        # Simple HEAD comparison
-        ['git', 'diff', '--name-only', 'HEAD^', 'HEAD'],
-        ['git', 'diff', '--name-only', 'HEAD~1', 'HEAD'],
-    ]
+    # PR context compares the PR head to the merge base with main;
+    # without origin/main fall back to the last commit
+    result = run_git_command(['git', 'rev-parse', '--verify', '--quiet', 'origin/main'])
+    if result and result.returncode == 0:
+        revision_range = 'origin/main...HEAD'
+    else:
+        revision_range = 'HEAD~1..HEAD'
     
-    for cmd in strategies:
-        result = run_git_command(cmd)
-        if result and result.returncode == 0:
-            all_files = [f.strip() for f in result.stdout.strip().split('\n') if f.strip()]
-            # Filter for data-models/*.json
-            json_files = [f for f in all_files if f.startswith('data-models/') and f.endswith('.json')]
-            if json_files:
-                print(f"DEBUG: Found files with strategy: {json_files}", file=sys.stderr)
-                return json_files
+    # Deleted files are filtered out by git since there is nothing to parse;
+    # -z keeps paths intact even if they contain newlines
+    result = run_git_command([
+        'git', 'diff', '--name-only', '--diff-filter=AMR', '-z',
+        revision_range, '--', 'data-models/*.json'
+    ])
+    if result and result.returncode == 0:
+        json_files = [f for f in result.stdout.split('\0') if f]
+        if json_files:
+            if DEBUG:
+                print(f"DEBUG: Found files in {revision_range}: {json_files}", file=sys.stderr)
+            return json_files
     
-    print("DEBUG: No changed files found with any strategy", file=sys.stderr)
+    if DEBUG:
+        print("DEBUG: No changed files found", file=sys.stderr)
     return []
 
 
-def get_file_at_ref(file_path, ref):
+class CatFileBatch:
+    """Persistent `git cat-file --batch` process for reading blobs at a ref.
+
+    One subprocess serves every lookup, instead of one `git show` per file.
+    """
+
+    def __init__(self):
+        self.proc = None
+        # Blobs already read, keyed by (ref, path); lives as long as the process
+        self._blobs = {}
+
+    def __enter__(self):
+        self.proc = subprocess.Popen(
+            ['git', 'cat-file', '--batch'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0
+        )
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc.wait()
+        self._blobs.clear()
+
+    def _read_exact(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.proc.stdout.read(size)
+            if not chunk:
+                raise EOFError("git cat-file closed the pipe")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def fetch(self, ref, path):
+        """Return the raw bytes of path at ref, or None if it doesn't exist."""
+        self.proc.stdin.write(f"{ref}:{path}\n".encode())
+        header = self.proc.stdout.readline()
+        if not header:
+            raise EOFError("git cat-file closed the pipe")
+        
+        # Header is "<sha> <type> <size>", or "<object> missing"/"<object> ambiguous",
+        # which echo the request back and so may contain spaces from the path
+        parts = header.split()
+        if parts[-1] in (b'missing', b'ambiguous'):
+            if DEBUG:
+                print(f"DEBUG: Could not get file at {ref}: {header.decode(errors='replace').strip()}", file=sys.stderr)
+            return None
+        if len(parts) != 3 or parts[1] != b'blob':
+            if len(parts) == 3 and parts[2].isdigit():
+                # Not a blob (e.g. a tree); drain its payload to keep the pipe in step
+                self._read_exact(int(parts[2]) + 1)
+            if DEBUG:
+                print(f"DEBUG: Could not get file at {ref}: {header.decode(errors='replace').strip()}", file=sys.stderr)
+            return None
+        
+        data = self._read_exact(int(parts[2]))
+        self._read_exact(1)  # trailing newline
+        return data
+
+    def blob(self, ref, path):
+        """Like fetch, but cached so repeat lookups of the same blob skip the pipe."""
+        key = (ref, path)
+        if key not in self._blobs:
+            self._blobs[key] = self.fetch(ref, path)
+        return self._blobs[key]
+
+
+def get_file_at_ref(batch, file_path, ref):
     """Get file contents at a specific git ref."""
-    print(f"DEBUG: Getting {file_path} at {ref}", file=sys.stderr)
+    if DEBUG:
+        print(f"DEBUG: Getting {file_path} at {ref}", file=sys.stderr)
     try:
-        result = subprocess.run(
-            ['git', 'show', f'{ref}:{file_path}'],
-            capture_output=True,
-            text=True,
-            check=False
-        )
-        if result.returncode == 0:
-            return json.loads(result.stdout)
-        else:
-            print(f"DEBUG: Could not get file at {ref}: {result.stderr[:200]}", file=sys.stderr)
+        data = batch.blob(ref, file_path)
+        if data is not None:
+            return json_loads(data)
     except Exception as e:
-        print(f"DEBUG: Error getting file: {e}", file=sys.stderr)
+        if DEBUG:
+            print(f"DEBUG: Error getting file: {e}", file=sys.stderr)
     return None
 
 
+def matches_ref(batch, file_path, ref):
+    """Check whether the working-tree file is byte-identical to its blob at ref."""
+    try:
+        old_bytes = batch.blob(ref, file_path)
+        if old_bytes is None:
+            return False
+        with open(file_path, 'rb') as f:
+            return f.read() == old_bytes
+    except Exception as e:
+        if DEBUG:
+            print(f"DEBUG: Could not compare {file_path} to {ref}: {e}", file=sys.stderr)
+        return False
+
+
+def load_local_file(file_path):
+    """Parse a working-tree file."""
+    with open(file_path, 'rb') as f:
+        return json_loads(f.read())
+
+
 def get_simple_diff(old_spec, new_spec):
     """Get a simple list of changed top-level fields."""
     if not old_spec:
-        return [f"✨ New file created with {len(json.dumps(new_spec))} characters"]
+        return ["✨ New file created"]
     
     changes = []
     
@@ -92,10 +199,8 @@ def get_simple_diff(old_spec, new_spec):
             else:
                 # Field modified
                 if isinstance(old_val, (dict, list)):
-                    old_len = len(json.dumps(old_val))
-                    new_len = len(json.dumps(new_val))
-                    if old_len != new_len:
-                        changes.append(f"🔄 Modified `{key}`: {old_len} → {new_len} characters")
+                    # Already known to differ, no need to serialize for a size
+                    changes.append(f"🔄 Modified `{key}`")
                 elif isinstance(old_val, str) and len(str(old_val)) > 50:
                     changes.append(f"🔄 Modified `{key}`: {len(str(old_val))} → {len(str(new_val))} characters")
                 else:
@@ -104,28 +209,40 @@ def get_simple_diff(old_spec, new_spec):
     return changes
 
 
+def _column_fingerprint(col):
+    """Stable hash of a column's full definition."""
+    if orjson:
+        return hash(orjson.dumps(col, option=orjson.OPT_SORT_KEYS))
+    return hash(json.dumps(col, sort_keys=True, separators=(',', ':')))
+
+
 def compare_columns(old_cols, new_cols):
     """Compare column lists and return changes."""
-    # Use column ID as the key if available, otherwise name
-    old_dict = {}
-    for c in (old_cols or []):
-        key = c.get('id') or c.get('name', '')
-        old_dict[key] = c
+    # Use column ID as the key if available, otherwise name.
+    # Each column is fingerprinted once so unchanged ones skip the deep compare.
+    old_dict = {
+        (c.get('id') or c.get('name', '')): (c, _column_fingerprint(c))
+        for c in (old_cols or [])
+    }
+    new_dict = {
+        (c.get('id') or c.get('name', '')): (c, _column_fingerprint(c))
+        for c in (new_cols or [])
+    }
     
-    new_dict = {}
-    for c in (new_cols or []):
-        key = c.get('id') or c.get('name', '')
-        new_dict[key] = c
-    
-    added = set(new_dict.keys()) - set(old_dict.keys())
-    removed = set(old_dict.keys()) - set(new_dict.keys())
+    # Dict views support set operations directly
+    old_keys, new_keys = old_dict.keys(), new_dict.keys()
+    added = new_keys - old_keys
+    removed = old_keys - new_keys
     
     modified = []
     renamed = []
     
-    for key in set(old_dict.keys()) & set(new_dict.keys()):
-        old_col = old_dict[key]
-        new_col = new_dict[key]
+    for key in old_keys & new_keys:
+        old_col, old_fingerprint = old_dict[key]
+        new_col, new_fingerprint = new_dict[key]
+        
+        if old_fingerprint == new_fingerprint:
+            continue
         
         # Check if column was renamed (same ID, different name)
         old_name = old_col.get('name', '')
@@ -133,13 +250,21 @@ def compare_columns(old_cols, new_cols):
         if old_name != new_name and old_col.get('id') == new_col.get('id'):
             renamed.append((old_name, new_name))
         
-        # Check if anything else changed (formula, type, etc.)
-        if old_col != new_col:
-            modified.append(new_name or new_col.get('id', key))
+        # Anything else changed (formula, type, etc.)
+        modified.append(new_name or new_col.get('id', key))
     
     return added, removed, modified, renamed
 
 
+def _triage(old, new):
+    """Split the keys of two dicts into added, removed and common lists."""
+    added, common = [], []
+    for key in new:
+        (common if key in old else added).append(key)
+    removed = [key for key in old if key not in new]
+    return added, removed, common
+
+
 def analyze_changes(old_spec, new_spec):
     """Analyze changes between two specs."""
     changes = []
@@ -177,19 +302,20 @@ def analyze_changes(old_spec, new_spec):
     # Compare pages and elements
     old_pages = {p.get('id'): p for p in old_spec.get('pages', [])}
     new_pages = {p.get('id'): p for p in new_spec.get('pages', [])}
+    added_pages, removed_pages, common_pages = _triage(old_pages, new_pages)
     
     # New pages
-    for page_id in set(new_pages.keys()) - set(old_pages.keys()):
+    for page_id in added_pages:
         page = new_pages[page_id]
         changes.append(f"➕ New page: `{page.get('name', 'Unnamed')}`")
     
     # Removed pages
-    for page_id in set(old_pages.keys()) - set(new_pages.keys()):
+    for page_id in removed_pages:
         page = old_pages[page_id]
         changes.append(f"➖ Removed page: `{page.get('name', 'Unnamed')}`")
     
     # Modified pages
-    for page_id in set(old_pages.keys()) & set(new_pages.keys()):
+    for page_id in common_pages:
         old_page = old_pages[page_id]
         new_page = new_pages[page_id]
         
@@ -201,19 +327,20 @@ def analyze_changes(old_spec, new_spec):
         
         old_elements = {e.get('id'): e for e in old_page.get('elements', [])}
         new_elements = {e.get('id'): e for e in new_page.get('elements', [])}
+        added_elems, removed_elems, common_elems = _triage(old_elements, new_elements)
         
         # New elements
-        for elem_id in set(new_elements.keys()) - set(old_elements.keys()):
+        for elem_id in added_elems:
             elem = new_elements[elem_id]
             changes.append(f"➕ New {elem.get('kind', 'element')}: `{elem.get('name', 'Unnamed')}`")
         
         # Removed elements
-        for elem_id in set(old_elements.keys()) - set(new_elements.keys()):
+        for elem_id in removed_elems:
             elem = old_elements[elem_id]
             changes.append(f"➖ Removed {elem.get('kind', 'element')}: `{elem.get('name', 'Unnamed')}`")
         
         # Modified elements
-        for elem_id in set(old_elements.keys()) & set(new_elements.keys()):
+        for elem_id in common_elems:
             old_elem = old_elements[elem_id]
             new_elem = new_elements[elem_id]
             
@@ -246,53 +373,67 @@ def analyze_changes(old_spec, new_spec):
 
 
 def main():
-    print("DEBUG: Starting diff report generation", file=sys.stderr)
+    if DEBUG:
+        print("DEBUG: Starting diff report generation", file=sys.stderr)
     
     changed_files = get_changed_files()
     
     if not changed_files:
-        print("DEBUG: No changed files detected", file=sys.stderr)
+        if DEBUG:
+            print("DEBUG: No changed files detected", file=sys.stderr)
         print("No data model changes detected.")
         return
     
-    print(f"**{len(changed_files)} data model file(s) changed:**\n")
+    # Collect the report and write it in one go at the end
+    out = []
+    out.append(f"**{len(changed_files)} data model file(s) changed:**\n")
     
-    for file_path in changed_files:
-        if not file_path:
-            continue
-        
-        print(f"DEBUG: Processing {file_path}", file=sys.stderr)
-        file_name = Path(file_path).name
-        print(f"### 📄 `{file_name}`\n")
-        
-        old_spec = get_file_at_ref(file_path, 'origin/main')
-        if not old_spec:
-            # Try alternative ref
-            old_spec = get_file_at_ref(file_path, 'HEAD^')
-        
-        try:
-            with open(file_path) as f:
-                new_spec = json.load(f)
-        except Exception as e:
-            print(f"⚠️ Could not parse JSON: {e}\n")
-            print(f"DEBUG: JSON parse error: {e}", file=sys.stderr)
-            continue
-        
-        # Try detailed analysis first
-        changes = analyze_changes(old_spec, new_spec)
-        
-        # Fallback to simple diff if no changes detected but files are different
-        if not changes and old_spec != new_spec:
-            print("DEBUG: Using simple diff fallback", file=sys.stderr)
-            changes = get_simple_diff(old_spec, new_spec)
-        
-        if changes:
-            for change in changes:
-                print(change)
-        else:
-            print("_No structural changes detected (version numbers may have changed)_")
-        
-        print()
+    # One git cat-file process serves every lookup for the whole run
+    with CatFileBatch() as batch:
+        for file_path in changed_files:
+            if not file_path:
+                continue
+            
+            if DEBUG:
+                print(f"DEBUG: Processing {file_path}", file=sys.stderr)
+            file_name = Path(file_path).name
+            out.append(f"### 📄 `{file_name}`\n")
+            
+            # Paths touched without a content change (merges, rebases) need no parsing
+            if matches_ref(batch, file_path, 'origin/main'):
+                out.append("_No changes_\n")
+                continue
+            
+            old_spec = get_file_at_ref(batch, file_path, 'origin/main')
+            if not old_spec:
+                # Try alternative ref
+                old_spec = get_file_at_ref(batch, file_path, 'HEAD^')
+            
+            try:
+                new_spec = load_local_file(file_path)
+            except Exception as e:
+                out.append(f"⚠️ Could not parse JSON: {e}\n")
+                if DEBUG:
+                    print(f"DEBUG: JSON parse error: {e}", file=sys.stderr)
+                continue
+            
+            # Try detailed analysis first
+            changes = analyze_changes(old_spec, new_spec)
+            
+            # Fallback to simple diff if no changes detected but files are different
+            if not changes and old_spec != new_spec:
+                if DEBUG:
+                    print("DEBUG: Using simple diff fallback", file=sys.stderr)
+                changes = get_simple_diff(old_spec, new_spec)
+            
+            if changes:
+                out.extend(changes)
+            else:
+                out.append("_No structural changes detected (version numbers may have changed)_")
+            
+            out.append('')
+    
+    sys.stdout.write('\n'.join(out) + '\n')
 
 
 if __name__ == '__main__':
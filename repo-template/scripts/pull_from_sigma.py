@@ -16,12 +16,24 @@ Environment variables:
 
 import os
 import sys
+import copy
 import json
+import re
+import threading
 import yaml
 import argparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
+
+try:
+    import orjson
+except ImportError:
+    # Fall back to the stdlib json module
+    orjson = None
 
 # API base URLs by cloud (fallback if not in config.yml)
 CLOUD_URLS = {
@@ -34,18 +46,32 @@ CLOUD_URLS = {
     'azure-uk': 'https://api.uk.azure.sigmacomputing.com',
 }
 
+# (connect, read) timeout in seconds for every API call
+REQUEST_TIMEOUT = (5, 30)
+
+# Number of data models downloaded concurrently
+MAX_WORKERS = 8
+
+# Use the libyaml C bindings when PyYAML was built with them
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Used by sanitize_filename
+_FILENAME_TRANS = str.maketrans({' ': '-', '_': '-'})
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]+')
+
 
 def load_config():
     config_path = Path('config.yml')
     if config_path.exists():
         with open(config_path) as f:
-            return yaml.safe_load(f) or {}
+            return yaml.load(f, Loader=YAML_LOADER) or {}
     return {}
 
 
 def save_config(config):
     with open('config.yml', 'w') as f:
-        yaml.dump(config, f, default_flow_style=False, sort_keys=False)
+        yaml.dump(config, f, Dumper=YAML_DUMPER, default_flow_style=False, sort_keys=False)
 
 
 class SigmaClient:
@@ -85,25 +111,43 @@ class SigmaClient:
         
         print(f"🔗 Using API: {self.base_url}")
         
+        # Shared across worker threads so connections are reused
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=(429, 500, 502, 503, 504),
+                # Hand the last response back so callers can report Sigma's error
+                raise_on_status=False
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
         self.access_token = None
         self._authenticate()
     
     def _authenticate(self):
         print(f"🔐 Authenticating with Sigma...")
         
-        response = requests.post(
+        response = self.session.post(
             f"{self.base_url}/v2/auth/token",
             data={
                 'grant_type': 'client_credentials',
                 'client_id': self.client_id,
                 'client_secret': self.client_secret
-            }
+            },
+            timeout=REQUEST_TIMEOUT
         )
         
         if response.status_code != 200:
             raise Exception(f"Authentication failed: {response.text}")
         
         self.access_token = response.json()['access_token']
+        self.session.headers.update(self._headers())
         print("✅ Authenticated successfully")
     
     def _headers(self):
@@ -112,39 +156,87 @@ class SigmaClient:
             'Content-Type': 'application/json'
         }
     
+    def iter_data_models(self):
+        """Yield data models, fetching one page at a time as needed."""
+        params = {}
+        while True:
+            response = self.session.get(
+                f"{self.base_url}/v2/datamodels",
+                params=params,
+                timeout=REQUEST_TIMEOUT
+            )
+            
+            if response.status_code != 200:
+                raise Exception(f"Failed to list data models: {response.text}")
+            
+            body = response.json()
+            yield from body.get('entries', [])
+            
+            next_page = body.get('nextPage')
+            if not next_page:
+                return
+            params = {'page': next_page}
+    
     def list_data_models(self):
-        response = requests.get(
-            f"{self.base_url}/v2/datamodels",
-            headers=self._headers()
-        )
-        
-        if response.status_code != 200:
-            raise Exception(f"Failed to list data models: {response.text}")
-        
-        return response.json().get('entries', [])
+        return list(self.iter_data_models())
     
     def get_data_model_spec(self, data_model_id):
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/v3alpha/datamodels/{data_model_id}/spec",
-            headers=self._headers()
+            timeout=REQUEST_TIMEOUT
         )
         
         if response.status_code != 200:
             raise Exception(f"Failed to get data model spec: {response.text}")
         
-        return response.json()
+        # Parse the raw body bytes rather than decoding it to str first;
+        # specs can be tens of MB
+        return json_loads(response.content)
+
+
+def json_loads(data):
+    """Parse JSON from bytes, using orjson when available."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def write_json(file_path, data):
+    """Write data as indented JSON, using orjson when available.
+    
+    Keys are sorted so repeated pulls produce minimal git diffs. The file is
+    written to a uniquely named temporary file and renamed into place, so
+    concurrent writers never leave a mix of two specs behind.
+    """
+    tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+    try:
+        if orjson:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+        else:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
 
 
 def sanitize_filename(name):
     """Convert name to a safe filename."""
-    return name.lower().replace(' ', '-').replace('_', '-').\
-        encode('ascii', 'ignore').decode().\
-        replace('--', '-').strip('-')[:50] or 'unnamed'
+    name = _NON_ASCII_RE.sub('', name.lower().translate(_FILENAME_TRANS))
+    return name.replace('--', '-').strip('-')[:50] or 'unnamed'
 
 
-def pull_data_model(client, data_model_id, output_dir, config):
-    """Pull a single data model and save to file."""
-    print(f"\n📥 Pulling data model: {data_model_id}")
+def pull_data_model(client, data_model_id, output_dir, now_iso):
+    """Pull a single data model and save to file.
+    
+    Returns the config entry for the data model, or None on failure.
+    Safe to run from worker threads; the caller merges the entry into config.
+    """
+    # Printed as one block at the end so concurrent workers don't interleave
+    lines = [f"\n📥 Pulling data model: {data_model_id}"]
     
     try:
         spec = client.get_data_model_spec(data_model_id)
@@ -154,26 +246,22 @@ def pull_data_model(client, data_model_id, output_dir, config):
         file_path = output_dir / file_name
         
         # Save JSON file
-        with open(file_path, 'w') as f:
-            json.dump(spec, f, indent=2)
-        
-        print(f"   ✅ Saved: {file_path}")
+        write_json(file_path, spec)
         
-        # Update config
-        if 'data_models' not in config:
-            config['data_models'] = {}
+        lines.append(f"   ✅ Saved: {file_path}")
         
-        config['data_models'][data_model_id] = {
+        return {
             'file': file_name,
             'name': model_name,
-            'last_pulled': datetime.utcnow().isoformat() + 'Z'
+            'last_pulled': now_iso
         }
         
-        return True
-        
     except Exception as e:
-        print(f"   ❌ Error: {e}")
-        return False
+        lines.append(f"   ❌ Error: {e}")
+        return None
+    
+    finally:
+        print('\n'.join(lines) + '\n', end='')
 
 
 def main():
@@ -198,8 +286,9 @@ def main():
     output_dir = Path(args.output)
     output_dir.mkdir(exist_ok=True)
     
-    # Load config
+    # Load config, keeping a copy to tell whether it needs saving
     config = load_config()
+    original_config = copy.deepcopy(config)
     
     # Get data models to pull
     if args.id:
@@ -207,12 +296,16 @@ def main():
     elif args.name:
         # Find by name
         print("\n📋 Searching for data model by name...")
-        models = client.list_data_models()
-        matches = [m for m in models if m.get('name', '').lower() == args.name.lower()]
-        if not matches:
+        target = args.name.lower()
+        data_model_ids = []
+        # Stop paging through the list as soon as the model is found
+        for m in client.iter_data_models():
+            if m.get('name', '').lower() == target:
+                data_model_ids.append(m['dataModelId'])
+                break
+        if not data_model_ids:
             print(f"❌ No data model found with name: {args.name}")
             sys.exit(1)
-        data_model_ids = [m['dataModelId'] for m in matches]
     else:
         # Pull all
         print("\n📋 Fetching all data models...")
@@ -220,18 +313,32 @@ def main():
         data_model_ids = [m['dataModelId'] for m in models]
         print(f"   Found {len(data_model_ids)} data models")
     
-    # Pull each data model
+    # Pull data models concurrently; the work is almost all HTTP wait
     success = 0
     failed = 0
     
-    for dm_id in data_model_ids:
-        if pull_data_model(client, dm_id, output_dir, config):
-            success += 1
-        else:
-            failed += 1
+    # Every model in this run shares one pull timestamp
+    now_iso = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(
+            lambda dm_id: pull_data_model(client, dm_id, output_dir, now_iso),
+            data_model_ids
+        )
+        
+        # Results come back in input order, keeping config.yml stable
+        for dm_id, entry in zip(data_model_ids, results):
+            if entry:
+                if 'data_models' not in config:
+                    config['data_models'] = {}
+                config['data_models'][dm_id] = entry
+                success += 1
+            else:
+                failed += 1
     
     # Save config
-    save_config(config)
+    if config != original_config:
+        save_config(config)
     
     # Summary
     print("\n" + "=" * 60)
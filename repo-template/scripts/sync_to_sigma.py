@@ -5,6 +5,7 @@ Sync data model JSON files to Sigma Computing via the API.
 Usage:
     python sync_to_sigma.py data-models/sales-model.json data-models/inventory-model.json
     python sync_to_sigma.py --all
+    python sync_to_sigma.py --all --force   # re-upload files unchanged since the last sync
     
 Environment variables:
     SIGMA_CLIENT_ID - API client ID (required)
@@ -15,11 +16,26 @@ Environment variables:
 
 import os
 import sys
+import copy
 import json
+import mmap
+import hashlib
+import functools
+import time
+import threading
 import yaml
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
+
+try:
+    import orjson
+except ImportError:
+    # Fall back to the stdlib json module
+    orjson = None
 
 # API base URLs by cloud (fallback if not in config.yml)
 CLOUD_URLS = {
@@ -32,20 +48,113 @@ CLOUD_URLS = {
     'azure-uk': 'https://api.uk.azure.sigmacomputing.com',
 }
 
+# (connect, read) timeout in seconds for every API call
+REQUEST_TIMEOUT = (5, 30)
+
+# Use the libyaml C bindings when PyYAML was built with them
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Number of files synced concurrently
+MAX_WORKERS = 8
+
+# Spec files at least this large are memory-mapped for parsing
+MMAP_THRESHOLD = 10 * 1024 * 1024
+
+# Server-assigned fields dropped from a spec before creating a data model
+STALE_SPEC_KEYS = frozenset({
+    'dataModelId', 'ownerId', 'createdBy', 'updatedBy',
+    'createdAt', 'updatedAt', 'documentVersion',
+    'latestDocumentVersion', 'url'
+})
+
+# Access tokens are reused across runs until shortly before they expire
+TOKEN_CACHE_PATH = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'sigma-sync' / 'token.json'
+TOKEN_EXPIRY_MARGIN = 60
+
+
+@functools.lru_cache(maxsize=4)
+def _parse_config(path, mtime_ns):
+    with open(path) as f:
+        return yaml.load(f, Loader=YAML_LOADER) or {}
+
 
 def load_config():
-    """Load the config.yml file."""
+    """Load the config.yml file.
+    
+    Parsed once per file version; callers get their own copy to mutate.
+    """
     config_path = Path('config.yml')
     if config_path.exists():
-        with open(config_path) as f:
-            return yaml.safe_load(f) or {}
+        mtime_ns = config_path.stat().st_mtime_ns
+        return copy.deepcopy(_parse_config(str(config_path.resolve()), mtime_ns))
     return {}
 
 
 def save_config(config):
-    """Save the config.yml file."""
-    with open('config.yml', 'w') as f:
-        yaml.dump(config, f, default_flow_style=False, sort_keys=False)
+    """Save the config.yml file.
+    
+    Written to a temporary file first and renamed into place, so the
+    file is never left half-written.
+    """
+    tmp_path = 'config.yml.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            yaml.dump(config, f, Dumper=YAML_DUMPER, default_flow_style=False, sort_keys=False)
+        os.replace(tmp_path, 'config.yml')
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def load_cached_token(base_url, client_id):
+    """Return a cached access token that is still valid, or None."""
+    try:
+        with open(TOKEN_CACHE_PATH) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    # A malformed cache is treated as no cache, not as a fatal error
+    if not isinstance(cached, dict):
+        return None
+    try:
+        # Only reuse a token issued for the same API and client
+        if cached.get('base_url') != base_url or cached.get('client_id') != client_id:
+            return None
+        if cached.get('expires_at', 0) - time.time() <= TOKEN_EXPIRY_MARGIN:
+            return None
+    except (TypeError, AttributeError):
+        return None
+    access_token = cached.get('access_token')
+    return access_token if isinstance(access_token, str) else None
+
+
+def save_cached_token(base_url, client_id, access_token, expires_in):
+    """Cache an access token on disk, readable only by the current user."""
+    try:
+        TOKEN_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(TOKEN_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # os.open only applies the mode when it creates the file
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'base_url': base_url,
+                'client_id': client_id,
+                'access_token': access_token,
+                'expires_at': time.time() + expires_in
+            }, f)
+    except OSError as e:
+        print(f"⚠️  Could not cache access token: {e}")
+
+
+def clear_cached_token():
+    """Remove the cached access token."""
+    try:
+        TOKEN_CACHE_PATH.unlink()
+    except FileNotFoundError:
+        pass
 
 
 class SigmaClient:
@@ -85,39 +194,92 @@ class SigmaClient:
         
         print(f"🔗 Using API: {self.base_url}")
         
+        # Reuse connections across API calls
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=(429, 500, 502, 503, 504),
+                # Hand the last response back so callers can report Sigma's error
+                raise_on_status=False
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        self._auth_lock = threading.Lock()
         self.access_token = None
-        self._authenticate()
+        cached_token = load_cached_token(self.base_url, self.client_id)
+        if cached_token:
+            self._use_token(cached_token)
+            print("✅ Using cached access token")
+        else:
+            self._authenticate()
     
-    def _authenticate(self):
+    def _authenticate(self, log=print):
         """Get access token from Sigma API."""
-        print(f"🔐 Authenticating with Sigma...")
+        log(f"🔐 Authenticating with Sigma...")
         
-        response = requests.post(
+        response = self.session.post(
             f"{self.base_url}/v2/auth/token",
+            # Override the JSON headers and any stale bearer set on the session
+            headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'Authorization': None
+            },
             data={
                 'grant_type': 'client_credentials',
                 'client_id': self.client_id,
                 'client_secret': self.client_secret
-            }
+            },
+            timeout=REQUEST_TIMEOUT
         )
         
         if response.status_code != 200:
             raise Exception(f"Authentication failed: {response.text}")
         
-        self.access_token = response.json()['access_token']
-        print("✅ Authenticated successfully")
+        token = response.json()
+        self._use_token(token['access_token'])
+        if token.get('expires_in'):
+            save_cached_token(self.base_url, self.client_id, self.access_token, token['expires_in'])
+        log("✅ Authenticated successfully")
     
-    def _headers(self):
-        return {
-            'Authorization': f'Bearer {self.access_token}',
+    def _request(self, method, url, **kwargs):
+        """Send an API request, re-authenticating once if the token is rejected."""
+        token = self.access_token
+        response = self.session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        
+        if response.status_code == 401:
+            with self._auth_lock:
+                # Another worker may have refreshed the token already
+                if self.access_token == token:
+                    clear_cached_token()
+                    # Runs on a worker thread, so print the messages as one block
+                    lines = []
+                    try:
+                        self._authenticate(log=lines.append)
+                    finally:
+                        print('\n'.join(lines) + '\n', end='')
+            response = self.session.request(method, url, timeout=REQUEST_TIMEOUT, **kwargs)
+        
+        return response
+    
+    def _use_token(self, access_token):
+        """Build the auth headers once per token and attach them to the session."""
+        self.access_token = access_token
+        self.session.headers.update({
+            'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
-        }
+        })
     
     def list_data_models(self):
         """Get all data models from Sigma."""
-        response = requests.get(
-            f"{self.base_url}/v2/datamodels",
-            headers=self._headers()
+        response = self._request(
+            'GET',
+            f"{self.base_url}/v2/datamodels"
         )
         
         if response.status_code != 200:
@@ -127,9 +289,9 @@ class SigmaClient:
     
     def get_data_model_spec(self, data_model_id):
         """Get the JSON representation of a data model."""
-        response = requests.get(
-            f"{self.base_url}/v3alpha/datamodels/{data_model_id}/spec",
-            headers=self._headers()
+        response = self._request(
+            'GET',
+            f"{self.base_url}/v3alpha/datamodels/{data_model_id}/spec"
         )
         
         if response.status_code != 200:
@@ -139,9 +301,9 @@ class SigmaClient:
     
     def create_data_model(self, spec):
         """Create a new data model from a JSON spec."""
-        response = requests.post(
+        response = self._request(
+            'POST',
             f"{self.base_url}/v3alpha/datamodels/spec",
-            headers=self._headers(),
             json=spec
         )
         
@@ -152,9 +314,9 @@ class SigmaClient:
     
     def update_data_model(self, data_model_id, spec):
         """Update an existing data model from a JSON spec."""
-        response = requests.put(
+        response = self._request(
+            'PUT',
             f"{self.base_url}/v3alpha/datamodels/{data_model_id}/spec",
-            headers=self._headers(),
             json=spec
         )
         
@@ -164,63 +326,139 @@ class SigmaClient:
         return response.json()
 
 
-def get_data_model_id_for_file(file_path, config):
-    """Look up the Sigma data model ID for a file path."""
-    file_name = Path(file_path).name
+def json_loads(data):
+    """Parse JSON from bytes, using orjson when available."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def read_json_file(file_path):
+    """Parse a JSON file from its raw bytes.
+    
+    With orjson, large files are memory-mapped and parsed in place rather
+    than copied into a bytes object first.
+    """
+    with open(file_path, 'rb') as f:
+        if orjson and os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    return orjson.loads(view)
+        return json_loads(f.read())
+
+
+def write_json(file_path, data):
+    """Write data as indented JSON, using orjson when available.
     
-    # Check config for mapping
-    mappings = config.get('data_models', {})
-    for dm_id, info in mappings.items():
-        if info.get('file') == file_name:
-            return dm_id
+    Keys are sorted to match files written by pull_from_sigma.py. The file is
+    written to a uniquely named temporary file and renamed into place, so
+    concurrent writers never leave a mix of two specs behind.
+    """
+    tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+    try:
+        if orjson:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+        else:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def spec_hash(spec):
+    """SHA-256 of a spec's canonical (sorted-key, compact) JSON encoding."""
+    if orjson:
+        canonical = orjson.dumps(spec, option=orjson.OPT_SORT_KEYS)
+    else:
+        canonical = json.dumps(spec, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def is_full_spec(result):
+    """Check whether an API response is a complete data model spec."""
+    return isinstance(result, dict) and 'documentVersion' in result and 'pages' in result
+
+
+def build_file_index(config):
+    """Map each file name in config to its Sigma data model ID."""
+    file_index = {}
+    for dm_id, info in config.get('data_models', {}).items():
+        # First mapping wins if a file is listed more than once
+        if info.get('file'):
+            file_index.setdefault(info['file'], dm_id)
+    return file_index
+
+
+@functools.lru_cache(maxsize=8)
+def _coerce_schema_version(value):
+    """Convert "v1" or "1" to integer 1."""
+    return int(value.removeprefix('v'))
+
+
+def sync_file(client, file_path, config, file_index, now_iso, force=False):
+    """Sync a single data model file to Sigma.
     
-    return None
+    Returns a (success, mapping) tuple, where mapping is the
+    (data_model_id, info) pair to record in config, or None.
+    Safe to run from worker threads; config is only read here.
+    """
+    lines = []
+    try:
+        return _sync_file(client, file_path, config, file_index, now_iso, force, lines.append)
+    finally:
+        # Print each file's log as one block so concurrent workers don't interleave
+        print('\n'.join(lines) + '\n', end='')
 
 
-def sync_file(client, file_path, config):
-    """Sync a single data model file to Sigma."""
+def _sync_file(client, file_path, config, file_index, now_iso, force, log):
     file_path = Path(file_path)
     
     if not file_path.exists():
-        print(f"⚠️  File not found: {file_path}")
-        return False
-    
-    print(f"\n📄 Processing: {file_path.name}")
-    
-    # Load the JSON spec
-    with open(file_path) as f:
-        spec = json.load(f)
-    
-    model_name = spec.get('name', file_path.stem)
+        log(f"⚠️  File not found: {file_path}")
+        return False, None
     
-    # Check if we have an existing ID mapping
-    data_model_id = get_data_model_id_for_file(file_path, config)
-    
-    # Also check if the spec itself contains an ID
-    if not data_model_id and spec.get('dataModelId'):
-        data_model_id = spec['dataModelId']
+    log(f"\n📄 Processing: {file_path.name}")
     
     try:
+        # Load the JSON spec
+        spec = read_json_file(file_path)
+        
+        model_name = spec.get('name', file_path.stem)
+        
+        # Check if we have an existing ID mapping
+        data_model_id = file_index.get(file_path.name)
+        
+        # Also check if the spec itself contains an ID
+        if not data_model_id and spec.get('dataModelId'):
+            data_model_id = spec['dataModelId']
+        
+        # Nothing to upload if the file matches what was last synced
+        if data_model_id and not force:
+            synced_hash = config.get('data_models', {}).get(data_model_id, {}).get('content_sha256')
+            if synced_hash and synced_hash == spec_hash(spec):
+                log("   ⏭️  Unchanged since last sync, skipping")
+                return True, None
+        
         if data_model_id:
             # Update existing
-            print(f"   Updating data model: {data_model_id}")
+            log(f"   Updating data model: {data_model_id}")
             result = client.update_data_model(data_model_id, spec)
-            print(f"   ✅ Updated: {model_name}")
+            log(f"   ✅ Updated: {model_name}")
         else:
             # Create new
-            print(f"   Creating new data model: {model_name}")
+            log(f"   Creating new data model: {model_name}")
             
             # Remove any stale IDs from the spec for creation
-            spec_clean = {k: v for k, v in spec.items() 
-                        if k not in ['dataModelId', 'ownerId', 'createdBy', 'updatedBy', 
-                                    'createdAt', 'updatedAt', 'documentVersion', 
-                                    'latestDocumentVersion', 'url']}
+            spec_clean = {k: v for k, v in spec.items() if k not in STALE_SPEC_KEYS}
             
             # Ensure schemaVersion is an integer
             if 'schemaVersion' in spec_clean:
                 if isinstance(spec_clean['schemaVersion'], str):
-                    # Convert "v1" or "1" to integer 1
-                    spec_clean['schemaVersion'] = int(spec_clean['schemaVersion'].replace('v', ''))
+                    spec_clean['schemaVersion'] = _coerce_schema_version(spec_clean['schemaVersion'])
             else:
                 spec_clean['schemaVersion'] = 1
             
@@ -230,7 +468,7 @@ def sync_file(client, file_path, config):
                 folder_id = config.get('default_folder_id') or os.environ.get('SIGMA_FOLDER_ID')
                 if folder_id:
                     spec_clean['folderId'] = folder_id
-                    print(f"   Using folder: {folder_id}")
+                    log(f"   Using folder: {folder_id}")
                 else:
                     raise Exception(
                         "folderId is required for new data models. "
@@ -240,62 +478,85 @@ def sync_file(client, file_path, config):
             
             result = client.create_data_model(spec_clean)
             data_model_id = result.get('dataModelId')
-            print(f"   ✅ Created with ID: {data_model_id}")
+            log(f"   ✅ Created with ID: {data_model_id}")
         
         # After create/update, fetch the latest spec from Sigma and write back
         # This keeps GitHub in sync with Sigma's version numbers
+        local_spec = spec
         if data_model_id:
-            print(f"   Syncing back from Sigma...")
+            log(f"   Syncing back from Sigma...")
             try:
-                latest_spec = client.get_data_model_spec(data_model_id)
-                with open(file_path, 'w') as f:
-                    json.dump(latest_spec, f, indent=2)
-                print(f"   ✅ Updated local file with Sigma's version (v{latest_spec.get('documentVersion', '?')})")
+                # Skip the refetch when the create/update response is already the spec
+                if is_full_spec(result):
+                    latest_spec = result
+                else:
+                    latest_spec = client.get_data_model_spec(data_model_id)
+                write_json(file_path, latest_spec)
+                local_spec = latest_spec
+                log(f"   ✅ Updated local file with Sigma's version (v{latest_spec.get('documentVersion', '?')})")
             except Exception as e:
-                print(f"   ⚠️  Could not sync back: {e}")
-                # Fall back to just adding the ID
-                spec['dataModelId'] = data_model_id
-                with open(file_path, 'w') as f:
-                    json.dump(spec, f, indent=2)
+                log(f"   ⚠️  Could not sync back: {e}")
+                # Fall back to just adding the ID, unless the file already has it
+                if spec.get('dataModelId') != data_model_id:
+                    spec['dataModelId'] = data_model_id
+                    write_json(file_path, spec)
         
-        # Update config with the mapping
+        # Mapping for the caller to record in config
+        mapping = None
         if data_model_id:
-            if 'data_models' not in config:
-                config['data_models'] = {}
-            
-            config['data_models'][data_model_id] = {
+            mapping = (data_model_id, {
                 'file': file_path.name,
                 'name': model_name,
-                'last_synced': datetime.utcnow().isoformat() + 'Z'
-            }
+                'last_synced': now_iso,
+                # Hash of the file as written, so an unchanged file is skipped next time
+                'content_sha256': spec_hash(local_spec)
+            })
         
-        return True
+        return True, mapping
         
     except Exception as e:
-        print(f"   ❌ Error: {e}")
-        return False
+        log(f"   ❌ Error: {e}")
+        return False, None
 
 
 def main():
     args = sys.argv[1:]
     
+    # --force re-uploads files even if they match the last sync
+    force = '--force' in args
+    args = [arg for arg in args if arg != '--force']
+    
     if not args:
-        print("Usage: python sync_to_sigma.py <file1.json> [file2.json] ...")
-        print("       python sync_to_sigma.py --all")
+        print("Usage: python sync_to_sigma.py [--force] <file1.json> [file2.json] ...")
+        print("       python sync_to_sigma.py [--force] --all")
         sys.exit(1)
     
     # Handle --all flag
     if args[0] == '--all':
         data_models_dir = Path('data-models')
         if data_models_dir.exists():
-            args = [str(f) for f in data_models_dir.glob('*.json')]
+            # scandir entries carry their file type, so no extra stat per file
+            with os.scandir(data_models_dir) as entries:
+                args = [e.path for e in entries if e.name.endswith('.json') and e.is_file()]
         else:
             print("No data-models/ directory found")
             sys.exit(1)
     
-    if not args:
+    # Resolve the files to sync before spending an auth round-trip
+    json_files = []
+    missing = 0
+    for file_path in args:
+        if not file_path.endswith('.json'):
+            continue
+        if Path(file_path).exists():
+            json_files.append(file_path)
+        else:
+            print(f"⚠️  File not found: {file_path}")
+            missing += 1
+    
+    if not json_files:
         print("No JSON files to sync")
-        sys.exit(0)
+        sys.exit(1 if missing else 0)
     
     print("=" * 60)
     print("🔄 Sigma Data Model Sync")
@@ -311,13 +572,28 @@ def main():
     # Load config
     config = load_config()
     
-    # Sync each file
+    # Sync files concurrently; the work is almost all HTTP wait
     success = 0
-    failed = 0
+    failed = missing
+    file_index = build_file_index(config)
     
-    for file_path in args:
-        if file_path.endswith('.json'):
-            if sync_file(client, file_path, config):
+    # Every file in this run shares one sync timestamp
+    now_iso = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(
+            lambda file_path: sync_file(client, file_path, config, file_index, now_iso, force),
+            json_files
+        )
+        
+        # Results come back in input order, keeping config.yml stable
+        for ok, mapping in results:
+            if mapping:
+                data_model_id, info = mapping
+                if 'data_models' not in config:
+                    config['data_models'] = {}
+                config['data_models'][data_model_id] = info
+            if ok:
                 success += 1
             else:
                 failed += 1